@@ -1,40 +1,68 @@
 import os
 import csv
+import logging
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from datetime import datetime
-
-from streamlit_calendar import calendar
+from zoneinfo import ZoneInfo
 
 from scheduler.models import UserPrefs, FixedEvent, Task
 from scheduler.scheduler import generate_schedule
 
-from prometheus_client import start_http_server, Summary, Counter
 import time
 
+logger = logging.getLogger(__name__)
+
+
+# Calendar colour per task priority
+PRIORITY_COLORS = {
+    1: "#2ca02c",  # green
+    2: "#1f77b4",  # blue
+    3: "#d62728",  # red
+}
+
+_DAY = pd.Timedelta(days=1)
+_WEEK = pd.Timedelta(days=7)
+
 
 # ✅ Create metric only once
 if "SCHEDULE_TIME" not in st.session_state:
-    st.session_state.SCHEDULE_TIME = Summary(
+    from prometheus_client import Histogram
+    st.session_state.SCHEDULE_TIME = Histogram(
         "schedule_generation_seconds",
         "Time spent generating weekly AI schedule",
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5),
     )
 SCHEDULE_TIME = st.session_state.SCHEDULE_TIME
 
 # ✅ Create feedback counter only once
 if "FEEDBACK_COUNTER" not in st.session_state:
+    from prometheus_client import Counter
     st.session_state.FEEDBACK_COUNTER = Counter(
         "schedule_feedback_total",
         "Count of feedback submissions by rating",
         ["rating"],  # label = rating 1–5
     )
-FEEDBACK_COUNTER = st.session_state.FEEDBACK_COUNTER
+    # one bound child per rating, so a submit is a plain .inc()
+    st.session_state.FEEDBACK_CHILDREN = {
+        r: st.session_state.FEEDBACK_COUNTER.labels(rating=r) for r in (1, 2, 3, 4, 5)
+    }
+
+
+# ✅ Create feedback log writer only once
+if "feedback_executor" not in st.session_state:
+    st.session_state.feedback_executor = ThreadPoolExecutor(max_workers=1)
 
 
 # ✅ Start metrics server only once
 if "metrics_started" not in st.session_state:
-    start_http_server(8000)
+    from prometheus_client import start_http_server
+    try:
+        start_http_server(int(os.environ.get("METRICS_PORT", "8000")))
+    except OSError:
+        pass  # another session/process already serves metrics on this port
     st.session_state.metrics_started = True
 
 
@@ -50,10 +78,89 @@ def datetime_input(label: str, key: str):
         t = st.time_input(label + " time", key=key + "_time")
     return datetime.combine(d, t)
 
+
+def _tz() -> ZoneInfo:
+    """Time zone for prefs.tz, rebuilt only when the preference changes."""
+    if st.session_state.get("tz_name") != st.session_state.prefs.tz:
+        st.session_state.tz_name = st.session_state.prefs.tz
+        st.session_state.tz_obj = ZoneInfo(st.session_state.prefs.tz)
+    return st.session_state.tz_obj
+
+
+def _write_feedback_row(row: dict, log_path: str) -> None:
+    """Append one feedback row, writing the header first if the log is empty."""
+    with open(log_path, "a", newline="", encoding="utf-8", buffering=8192) as f:
+        writer = csv.writer(f)
+        if os.path.getsize(log_path) == 0:
+            writer.writerow(("timestamp", "rating", "comment"))
+        writer.writerow((row["timestamp"], row["rating"], row["comment"]))
+
+
+def _log_feedback_error(fut) -> None:
+    """Done-callback for feedback writes: log a failed write instead of dropping it."""
+    exc = fut.exception()
+    if exc is not None:
+        logger.error("Failed to write feedback row", exc_info=exc)
+
+
+def _run_schedule() -> None:
+    """
+    Generate the schedule for the selected week from the current session
+    inputs and store it (with its task subset and slots) in session state.
+    """
+    TZ = _tz()
+    week_start = st.session_state.week_start
+    week_end = week_start + _WEEK
+    now = pd.Timestamp.now(tz=TZ)
+
+    # Earliest allowed scheduling time
+    if week_start <= now <= week_end:
+        # Same week as “today” → don’t schedule in the past
+        # Round down to the nearest slot boundary
+        minutes = st.session_state.prefs.slot_minutes
+        start_from = now.floor(f"{minutes}min", ambiguous=bool(now.dst()))
+    elif now < week_start:
+        # Week in the future → okay to schedule from week_start
+        start_from = week_start
+    else:
+        # Week entirely in the past → allow full week (or you could block entirely)
+        start_from = week_start
+
+    t0 = time.perf_counter()
+    try:
+        scheduled_df, slots = generate_schedule(
+            week_start=week_start,
+            prefs=st.session_state.prefs,
+            fixed_events=st.session_state.fixed_events,
+            tasks=st.session_state.tasks,
+            missed_intervals=st.session_state.missed_intervals,
+            start_from=start_from,     # 👈 NEW
+        )
+    finally:
+        # failed runs are timed too
+        SCHEDULE_TIME.observe(time.perf_counter() - t0)
+
+    scheduled_df["color"] = scheduled_df["priority"].map(PRIORITY_COLORS).fillna("#d62728")
+    st.session_state.schedule_df = scheduled_df
+    # Only dynamic (task) IDs, not fixed events; filtered once per new schedule
+    dynamic_ids = [t.id for t in st.session_state.tasks]
+    st.session_state.sched_dyn = scheduled_df.query("id in @dynamic_ids")
+    st.session_state.slots = slots
+
+
+@st.cache_data(show_spinner=False)
+def _tasks_df(tasks: tuple) -> pd.DataFrame:
+    """Display table of (id, label, dur_h, priority, latest) tuples, reused across reruns."""
+    return pd.DataFrame(list(tasks), columns=["id", "label", "dur_h", "priority", "latest"])
+
 # Session State Setup
 if "fixed_events" not in st.session_state:
     st.session_state.fixed_events = []  # list[FixedEvent]
 
+if "fixed_events_df" not in st.session_state:
+    # display table, appended to on each add instead of rebuilt per rerun
+    st.session_state.fixed_events_df = pd.DataFrame(columns=["label", "start", "end"])
+
 if "tasks" not in st.session_state:
     st.session_state.tasks = []         # list[Task]
 
@@ -62,8 +169,8 @@ if "prefs" not in st.session_state:
 
 if "week_start" not in st.session_state:
     # default: next Monday local
-    today = pd.Timestamp.now(tz=st.session_state.prefs.tz)
-    monday = today - pd.Timedelta(days=today.weekday())  # this Monday
+    today = pd.Timestamp.now(tz=_tz())
+    monday = today - today.weekday() * _DAY  # this Monday
     st.session_state.week_start = monday.normalize()
 
 if "schedule_df" not in st.session_state:
@@ -71,6 +178,9 @@ if "schedule_df" not in st.session_state:
         columns=["id", "label", "start", "end", "priority"]
     )
 
+if "sched_dyn" not in st.session_state:
+    st.session_state.sched_dyn = st.session_state.schedule_df  # scheduled tasks only
+
 if "slots" not in st.session_state:
     st.session_state.slots = pd.DataFrame()
 
@@ -83,32 +193,43 @@ st.sidebar.title("AI Scheduling Assistant")
 
 # Week selector
 st.sidebar.subheader("Week")
-week_date = st.sidebar.date_input(
-    "Week of (Monday)",
-    value=st.session_state.week_start.date()
-)
-# update stored week_start (tz-aware)
-st.session_state.week_start = pd.Timestamp(
-    datetime.combine(week_date, datetime.min.time())
-).tz_localize(st.session_state.prefs.tz)
+with st.sidebar.form("week_form"):
+    week_date = st.date_input(
+        "Week of (Monday)",
+        value=st.session_state.week_start.date()
+    )
+    apply_week = st.form_submit_button("Apply week")
+    if apply_week:
+        # update stored week_start (tz-aware)
+        st.session_state.week_start = pd.Timestamp(
+            datetime.combine(week_date, datetime.min.time()), tz=_tz()
+        )
 
 # Preferences
 st.sidebar.subheader("Preferences")
-pm_start = st.sidebar.number_input("Morning start hour", 0, 23,
-                                   value=st.session_state.prefs.prefer_morning_start)
-pm_end = st.sidebar.number_input("Morning end hour", 0, 23,
-                                 value=st.session_state.prefs.prefer_morning_end)
-avoid_after = st.sidebar.number_input("Avoid scheduling after", 0, 23,
-                                      value=st.session_state.prefs.avoid_evenings_after)
-weekend_ok = st.sidebar.checkbox("Allow weekends?", value=st.session_state.prefs.weekend_ok)
-slot_minutes = st.sidebar.selectbox("Slot size (minutes)", [30, 60],
-                                    index=1 if st.session_state.prefs.slot_minutes == 60 else 0)
-
-st.session_state.prefs.prefer_morning_start = int(pm_start)
-st.session_state.prefs.prefer_morning_end = int(pm_end)
-st.session_state.prefs.avoid_evenings_after = int(avoid_after)
-st.session_state.prefs.weekend_ok = weekend_ok
-st.session_state.prefs.slot_minutes = int(slot_minutes)
+with st.sidebar.form("prefs_form"):
+    pm_start = st.number_input("Morning start hour", 0, 23,
+                               value=st.session_state.prefs.prefer_morning_start)
+    pm_end = st.number_input("Morning end hour", 0, 23,
+                             value=st.session_state.prefs.prefer_morning_end)
+    avoid_after = st.number_input("Avoid scheduling after", 0, 23,
+                                  value=st.session_state.prefs.avoid_evenings_after)
+    weekend_ok = st.checkbox("Allow weekends?", value=st.session_state.prefs.weekend_ok)
+    slot_minutes = st.selectbox("Slot size (minutes)", [30, 60],
+                                index=1 if st.session_state.prefs.slot_minutes == 60 else 0)
+    use_prophet = st.checkbox("Score slots with Prophet (slower)",
+                              value=st.session_state.prefs.use_prophet)
+    apply_prefs = st.form_submit_button("Apply preferences")
+    if apply_prefs:
+        st.session_state.prefs = replace(
+            st.session_state.prefs,
+            prefer_morning_start=int(pm_start),
+            prefer_morning_end=int(pm_end),
+            avoid_evenings_after=int(avoid_after),
+            weekend_ok=weekend_ok,
+            slot_minutes=int(slot_minutes),
+            use_prophet=use_prophet,
+        )
 
 # Add Fixed Event
 st.sidebar.subheader("Add Fixed Event")
@@ -119,14 +240,18 @@ with st.sidebar.form("fixed_form"):
     add_fixed = st.form_submit_button("Add Fixed Event")
     if add_fixed:
         if fe_label and fe_end > fe_start:
-            TZ = st.session_state.prefs.tz
-            st.session_state.fixed_events.append(
-                FixedEvent(
-                    id=f"fe{len(st.session_state.fixed_events)}",
-                    label=fe_label,
-                    start=pd.Timestamp(fe_start).tz_localize(TZ),
-                    end=pd.Timestamp(fe_end).tz_localize(TZ),
-                )
+            TZ = _tz()
+            fe = FixedEvent(
+                id=f"fe{len(st.session_state.fixed_events)}",
+                label=fe_label,
+                start=pd.Timestamp(fe_start, tz=TZ),
+                end=pd.Timestamp(fe_end, tz=TZ),
+            )
+            st.session_state.fixed_events.append(fe)
+            new_row = pd.DataFrame([{"label": fe.label, "start": fe.start, "end": fe.end}])
+            fedf = st.session_state.fixed_events_df
+            st.session_state.fixed_events_df = (
+                pd.concat([fedf, new_row], ignore_index=True) if not fedf.empty else new_row
             )
         else:
             st.sidebar.error("Please enter a label and ensure end > start")
@@ -142,8 +267,8 @@ with st.sidebar.form("task_form"):
     add_task = st.form_submit_button("Add Task")
     if add_task:
         if t_label:
-            TZ = st.session_state.prefs.tz
-            latest_ts = pd.Timestamp(t_deadline).tz_localize(TZ) if t_deadline else None
+            TZ = _tz()
+            latest_ts = pd.Timestamp(t_deadline, tz=TZ) if t_deadline else None
             st.session_state.tasks.append(
                 Task(
                     id=f"t{len(st.session_state.tasks)}",
@@ -164,25 +289,16 @@ col1, col2 = st.columns(2)
 with col1:
     st.markdown("### Current Fixed Events")
     if st.session_state.fixed_events:
-        fedf = pd.DataFrame([{
-            "label": fe.label,
-            "start": fe.start,
-            "end": fe.end,
-        } for fe in st.session_state.fixed_events])
-        st.dataframe(fedf)
+        st.dataframe(st.session_state.fixed_events_df)
     else:
         st.write("No fixed events yet.")
 
 with col2:
     st.markdown("### Current Dynamic Tasks")
     if st.session_state.tasks:
-        tdf = pd.DataFrame([{
-            "id": t.id,
-            "label": t.label,
-            "dur_h": t.dur_h,
-            "priority": t.priority,
-            "latest": t.latest,
-        } for t in st.session_state.tasks])
+        tdf = _tasks_df(tuple(
+            (t.id, t.label, t.dur_h, t.priority, t.latest) for t in st.session_state.tasks
+        ))
         st.dataframe(tdf)
     else:
         st.write("No tasks yet.")
@@ -191,61 +307,28 @@ with col2:
 if st.button("Generate Schedule"):
     st.session_state.missed_intervals = []  # reset misses on fresh plan
 
-    TZ = st.session_state.prefs.tz
-    week_start = st.session_state.week_start
-    week_end = week_start + pd.Timedelta(days=7)
-    now = pd.Timestamp.now(tz=TZ)
-
-    # Earliest allowed scheduling time
-    if week_start <= now <= week_end:
-        # Same week as “today” → don’t schedule in the past
-        # Round down to the nearest slot boundary
-        minutes = st.session_state.prefs.slot_minutes
-        minute_floor = (now.minute // minutes) * minutes
-        start_from = now.replace(minute=minute_floor, second=0, microsecond=0)
-    elif now < week_start:
-        # Week in the future → okay to schedule from week_start
-        start_from = week_start
-    else:
-        # Week entirely in the past → allow full week (or you could block entirely)
-        start_from = week_start
-
-    with SCHEDULE_TIME.time():
-        scheduled_df, slots = generate_schedule(
-            week_start=week_start,
-            prefs=st.session_state.prefs,
-            fixed_events=st.session_state.fixed_events,
-            tasks=st.session_state.tasks,
-            missed_intervals=st.session_state.missed_intervals,
-            start_from=start_from,     # 👈 NEW
-        )
-
-    st.session_state.schedule_df = scheduled_df
-    st.session_state.slots = slots
+    _run_schedule()
 
 
 
 # Real Calendar UI with FullCalendar
-if not st.session_state.schedule_df.empty:
+@st.fragment
+def _render_calendar():
+    """Calendar and utility plot; interacting with the calendar reruns only this."""
     st.markdown("## Weekly Calendar View")
 
     # Build events for FullCalendar
-    def priority_color(p):
-        if p >= 3:
-            return "#d62728"  # red
-        if p == 2:
-            return "#1f77b4"  # blue
-        return "#2ca02c"      # green
-
-    events = []
-    for _, row in st.session_state.schedule_df.iterrows():
-        events.append({
-            "title": row["label"],
-            "start": pd.Timestamp(row["start"]).isoformat(),
-            "end": pd.Timestamp(row["end"]).isoformat(),
-            "id": row["id"],
-            "color": priority_color(row["priority"]),
-        })
+    sched = st.session_state.schedule_df
+    starts = pd.to_datetime(sched["start"]).map(pd.Timestamp.isoformat)
+    ends = pd.to_datetime(sched["end"]).map(pd.Timestamp.isoformat)
+
+    events = pd.DataFrame({
+        "title": sched["label"],
+        "start": starts,
+        "end": ends,
+        "id": sched["id"],
+        "color": sched["color"],
+    }).to_dict("records")
 
     # Optionally show fixed events as separate color
     for fe in st.session_state.fixed_events:
@@ -267,14 +350,20 @@ if not st.session_state.schedule_df.empty:
         "firstDay": 1,  # Monday
     }
 
+    from streamlit_calendar import calendar
     calendar(events=events, options=cal_options, key="calendar")
 
     # Utility plot for transparency
     if not st.session_state.slots.empty:
+        import plotly.express as px
         st.markdown("### Predicted Slot Utility")
         fig = px.line(st.session_state.slots, x="ds", y="utility_base",
                       labels={"ds": "Time", "utility_base": "Utility"})
         st.plotly_chart(fig, use_container_width=True)
+
+
+if not st.session_state.schedule_df.empty:
+    _render_calendar()
 else:
     st.info("Add some events/tasks and click **Generate Schedule** to see the calendar.")
 
@@ -284,17 +373,18 @@ st.markdown("---")
 st.markdown("### Missed a dynamic event?")
 
 if not st.session_state.schedule_df.empty:
-    # Only dynamic (task) IDs, not fixed events
-    dynamic_ids = {t.id for t in st.session_state.tasks}
-    sched_dyn = st.session_state.schedule_df[
-        st.session_state.schedule_df["id"].isin(dynamic_ids)
-    ]
+    sched_dyn = st.session_state.sched_dyn
 
     if not sched_dyn.empty:
+        # "label (start)" per option, built in one vectorized pass
+        labels_map = dict(zip(
+            sched_dyn.index,
+            (sched_dyn["label"].astype(str) + " (" + sched_dyn["start"].astype(str) + ")").tolist(),
+        ))
         sel = st.selectbox(
             "Select the event you missed:",
             options=list(sched_dyn.index),
-            format_func=lambda idx: f'{sched_dyn.loc[idx, "label"]} ({sched_dyn.loc[idx, "start"]})'
+            format_func=labels_map.get,
         )
 
         if st.button("Mark as missed and reschedule"):
@@ -305,36 +395,8 @@ if not st.session_state.schedule_df.empty:
             # Add missed interval so optimizer avoids that block next time
             st.session_state.missed_intervals.append((start_missed, end_missed))
 
-            # Determine earliest allowed time
-            TZ = st.session_state.prefs.tz
-            week_start = st.session_state.week_start
-            week_end = week_start + pd.Timedelta(days=7)
-            now = pd.Timestamp.now(tz=TZ)
-
-            if week_start <= now <= week_end:
-                # Same week as today — block earlier slots
-                minutes = st.session_state.prefs.slot_minutes
-                minute_floor = (now.minute // minutes) * minutes
-                start_from = now.replace(minute=minute_floor, second=0, microsecond=0)
-            elif now < week_start:
-                # Week in future
-                start_from = week_start
-            else:
-                # Week in past
-                start_from = week_start
-
             # Re-run schedule with updated missed_intervals
-            scheduled_df, slots = generate_schedule(
-                week_start=week_start,
-                prefs=st.session_state.prefs,
-                fixed_events=st.session_state.fixed_events,
-                tasks=st.session_state.tasks,
-                missed_intervals=st.session_state.missed_intervals,
-                start_from=start_from,   # 👈 NEW
-            )
-
-            st.session_state.schedule_df = scheduled_df
-            st.session_state.slots = slots
+            _run_schedule()
 
             st.success("Schedule updated to account for the missed event.")
 
@@ -367,23 +429,19 @@ with st.form("feedback_form"):
     submitted = st.form_submit_button("Submit feedback")
 
 if submitted:
-    tz = st.session_state.prefs.tz
-    ts = pd.Timestamp.now(tz=tz)
+    ts = pd.Timestamp.now(tz=_tz())
 
     log_path = "feedback_log.csv"
     row = {
         "timestamp": ts.isoformat(),
         "rating": int(rating),
-        "comment": comment.replace("\n", " "),
+        "comment": comment.replace("\r", " ").replace("\n", " "),
     }
 
-    file_exists = os.path.isfile(log_path)
-    with open(log_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=row.keys())
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
+    # Append off the script thread so the rerun doesn't wait on disk I/O
+    fut = st.session_state.feedback_executor.submit(_write_feedback_row, row, log_path)
+    fut.add_done_callback(_log_feedback_error)
 
-    FEEDBACK_COUNTER.labels(rating=rating).inc()
+    st.session_state.FEEDBACK_CHILDREN[int(rating)].inc()
 
     st.success("Thank you for your feedback!")
\ No newline at end of file
@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class UserPrefs:
     tz: str = "America/New_York"
     slot_minutes: int = 60
@@ -14,9 +14,10 @@ class UserPrefs:
     weekend_ok: bool = False
     buffer_minutes: int = 60        # gap between tasks
     max_hours_per_day: int = 4      # cap scheduled hours/day
+    use_prophet: bool = False       # fit Prophet instead of the analytic prior
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FixedEvent:
     id: str
     label: str
@@ -24,7 +25,7 @@ class FixedEvent:
     end: datetime    # tz-aware
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Task:
     id: str
     label: str
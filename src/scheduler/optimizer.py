@@ -1,78 +1,119 @@
 # scheduler/optimizer.py
-from typing import List, Dict, Tuple, Optional
+import math
+from typing import Any, List, Dict, Tuple, Optional
 
 import numpy as np
 import pandas as pd
 from ortools.sat.python import cp_model
 
 from .models import UserPrefs, Task
+from .prophet_model import to_ns
 # fixed events are already handled when building 'blocked' in scheduler.py
 
+UTILITY_SCALE = 10_000  # CP-SAT objective coefficients must be integers
+
+# CP-SAT parameters shared by every solve. Each call gets its own CpSolver
+# (cheap to create), so concurrent Streamlit sessions solve in parallel.
+_SOLVER_PARAMS = {
+    "max_time_in_seconds": 10,
+}
+
+
+def _new_solver() -> cp_model.CpSolver:
+    solver = cp_model.CpSolver()
+    for name, value in _SOLVER_PARAMS.items():
+        setattr(solver.parameters, name, value)
+    return solver
+
+
+def task_dur_slots(dur_h: float, slot_minutes: int) -> int:
+    """Slots a task occupies: its duration rounded up, and never less than one slot."""
+    return max(1, math.ceil(dur_h * 60 / slot_minutes))
+
 
 def build_blocked_mask(slots: pd.DataFrame, fixed_df: pd.DataFrame, prefs: UserPrefs,
                        missed_intervals: List[Tuple[pd.Timestamp, pd.Timestamp]],
                        start_from: Optional[pd.Timestamp],) -> np.ndarray:
 
+    # slots["ds"] is sorted, so each [start, end) maps to a contiguous index range
+    ds_ns = to_ns(slots["ds"])
     blocked = np.zeros(len(slots), dtype=bool)
 
     if start_from is not None:
-        blocked |= (slots["ds"] < start_from).values
+        blocked[:np.searchsorted(ds_ns, pd.Timestamp(start_from).value, side="left")] = True
 
+    starts = [s for s, _ in missed_intervals]  # missed intervals (don’t reuse these times)
+    ends = [e for _, e in missed_intervals]
     if not fixed_df.empty:
-        for _, r in fixed_df.iterrows():
-            mask = (slots["ds"] >= r["start"]) & (slots["ds"] < r["end"])
-            blocked |= mask.values
+        starts = list(fixed_df["start"]) + starts
+        ends = list(fixed_df["end"]) + ends
+
+    if starts:
+        lo = np.searchsorted(ds_ns, to_ns(starts), side="left")
+        hi = np.searchsorted(ds_ns, to_ns(ends), side="left")
+        for a, b in zip(lo, hi):
+            blocked[a:b] = True
 
     if not prefs.weekend_ok:
         blocked |= (slots["is_weekend"] == 1).values
 
-    # missed intervals (don’t reuse these times)
-    for s, e in missed_intervals:
-        mask = (slots["ds"] >= s) & (slots["ds"] < e)
-        blocked |= mask.values
-
     return blocked
 
 
-def feasible_starts(task_row: pd.Series,
+def feasible_starts(task_row: Any,
                     slots: pd.DataFrame,
                     blocked_mask: np.ndarray,
                     prefs: UserPrefs) -> List[int]:
-    dur_slots = int(task_row.dur_h * 60 // prefs.slot_minutes)
-    cand = []
-    for i in range(len(slots) - dur_slots + 1):
-        # any blocked inside?
-        if blocked_mask[i:i + dur_slots].any():
-            continue
-        # deadline check (end <= latest) if provided
-        if pd.notnull(task_row.latest):
-            end_time = slots.loc[i + dur_slots - 1, "ds"] + pd.Timedelta(
-                minutes=prefs.slot_minutes
-            )
-            if end_time > task_row.latest:
-                continue
-        cand.append(i)
-    return cand
+    slot_ns = prefs.slot_minutes * 60_000_000_000
+    dur_slots = task_dur_slots(task_row.dur_h, prefs.slot_minutes)
+    n_starts = len(slots) - dur_slots + 1
+    if n_starts <= 0:
+        return []
+
+    # any blocked inside? prefix sums give the blocked count of every window at once
+    c = np.concatenate(([0], np.cumsum(blocked_mask, dtype=np.int64)))
+    free = (c[dur_slots:dur_slots + n_starts] - c[:n_starts]) == 0
 
+    # deadline check (end <= latest) if provided
+    if pd.notnull(task_row.latest):
+        end_ns = to_ns(slots["ds"])[:n_starts] + dur_slots * slot_ns
+        free &= end_ns <= pd.Timestamp(task_row.latest).value
 
-def task_slot_utility(task_row: pd.Series, slot_row: pd.Series) -> float:
+    return np.flatnonzero(free).tolist()
+
+
+def task_slot_utility(task_row: Any, slots: pd.DataFrame) -> np.ndarray:
     """
-    Simple per-task utility adjustment on top of Prophet's base utility.
+    Simple per-task utility adjustment on top of Prophet's base utility,
+    evaluated for every slot at once.
     Modify this if you want sharper behavior.
     """
-    u = float(slot_row.utility_base)
+    u = slots["utility_base"].to_numpy(dtype=float)
     label = str(task_row.label).lower()
-    hour = int(slot_row.hour)
+    hour = slots["hour"].to_numpy()
 
     # Deep work prefers daytime
-    if "deep work" in label and not (8 <= hour <= 17):
-        u *= 0.85
+    if "deep work" in label:
+        u = np.where((hour < 8) | (hour > 17), u * 0.85, u)
 
     # Gym prefers morning
     if "gym" in label:
-        u *= 1.3 if 6 <= hour <= 9 else 0.8
+        u = u * np.where((hour >= 6) & (hour <= 9), 1.3, 0.8)
+
+    return np.clip(u, 0.0, 1.0)
 
-    return max(0.0, min(1.0, u))
+
+def feasible_starts_and_utility(task_row: Any,
+                                slots: pd.DataFrame,
+                                blocked_mask: np.ndarray,
+                                prefs: UserPrefs) -> Tuple[List[int], np.ndarray]:
+    """Feasible start indices of a task and the summed block utility at each."""
+    dur_slots = task_dur_slots(task_row.dur_h, prefs.slot_minutes)
+    cand = feasible_starts(task_row, slots, blocked_mask, prefs)
+    # block utility of start i is u_cum[i + dur] - u_cum[i]
+    u_cum = np.concatenate(([0.0], np.cumsum(task_slot_utility(task_row, slots))))
+    starts = np.asarray(cand, dtype=np.int64)
+    return cand, u_cum[starts + dur_slots] - u_cum[starts]
 
 
 def optimize_schedule(
@@ -103,110 +144,108 @@ def optimize_schedule(
 
     blocked = build_blocked_mask(slots, fixed_df, prefs, missed_intervals, start_from)
     slot_minutes = prefs.slot_minutes
+    slot_td = pd.Timedelta(minutes=slot_minutes)
 
     model = cp_model.CpModel()
     x: Dict[Tuple[int, int], cp_model.IntVar] = {}  # (task_index, start_idx) -> Bool
 
     dur_slots_list: List[int] = []
     feasible_by_task: List[List[int]] = []
+    utility_by_task: List[np.ndarray] = []
 
-    # Build feasible starts
-    for t_idx, task_row in tasks_df.iterrows():
-        dur_slots = int(task_row.dur_h * 60 // slot_minutes)
+    # Build feasible starts and their block utilities
+    for t_idx, task_row in enumerate(tasks_df.itertuples(index=False)):
+        dur_slots = task_dur_slots(task_row.dur_h, slot_minutes)
         dur_slots_list.append(dur_slots)
-        cand = feasible_starts(task_row, slots, blocked, prefs)
+        cand, u_blocks = feasible_starts_and_utility(task_row, slots, blocked, prefs)
         feasible_by_task.append(cand)
+        utility_by_task.append(u_blocks)
         for i in cand:
             x[(t_idx, i)] = model.NewBoolVar(f"x_t{t_idx}_i{i}")
 
     # Each task starts exactly once (if feasible)
-    for t_idx, _ in tasks_df.iterrows():
+    for t_idx in range(len(tasks_df)):
         cand = feasible_by_task[t_idx]
         if cand:
-            model.Add(sum(x[(t_idx, i)] for i in cand) == 1)
-
-    # No overlaps
-    for s in range(len(slots)):
-        covers = []
-        for t_idx, _ in tasks_df.iterrows():
-            dur = dur_slots_list[t_idx]
-            for i in feasible_by_task[t_idx]:
-                if i <= s < i + dur:
-                    covers.append(x[(t_idx, i)])
-        if covers:
-            model.Add(sum(covers) <= 1)
+            model.AddExactlyOne([x[(t_idx, i)] for i in cand])
 
-    # Buffer between tasks
+    # No overlaps + buffer between tasks: one interval per task (duration
+    # inflated by the buffer) under a single NoOverlap
     buffer_slots = prefs.buffer_minutes // slot_minutes
-    for t1_idx, _ in tasks_df.iterrows():
-        dur1 = dur_slots_list[t1_idx]
-        for t2_idx, _ in tasks_df.iterrows():
-            if t1_idx >= t2_idx:
-                continue
-            dur2 = dur_slots_list[t2_idx]
-            for i in feasible_by_task[t1_idx]:
-                for j in feasible_by_task[t2_idx]:
-                    # too close = not (completely separate + buffer)
-                    too_close = not (
-                        j >= i + dur1 + buffer_slots
-                        or i >= j + dur2 + buffer_slots
-                    )
-                    if too_close:
-                        model.AddBoolOr([
-                            x[(t1_idx, i)].Not(),
-                            x[(t2_idx, j)].Not()
-                        ])
+    intervals = []
+    start_vars: Dict[int, cp_model.IntVar] = {}  # task_index -> start slot
+    for t_idx in range(len(tasks_df)):
+        cand = feasible_by_task[t_idx]
+        if not cand:
+            continue
+        start_var = model.NewIntVarFromDomain(
+            cp_model.Domain.FromValues(cand), f"start_t{t_idx}"
+        )
+        start_vars[t_idx] = start_var
+        for i in cand:
+            model.Add(start_var == i).OnlyEnforceIf(x[(t_idx, i)])
+        intervals.append(model.NewFixedSizeIntervalVar(
+            start_var, dur_slots_list[t_idx] + buffer_slots, f"iv_t{t_idx}"
+        ))
+    model.AddNoOverlap(intervals)
+
+    # Branch on higher-priority tasks first, earliest start first
+    priorities = tasks_df["priority"].tolist()
+    model.AddDecisionStrategy(
+        [start_vars[t] for t in sorted(start_vars, key=lambda t: -priorities[t])],
+        cp_model.CHOOSE_FIRST,
+        cp_model.SELECT_MIN_VALUE,
+    )
 
     # Daily cap (approx): limit number of task-blocks touching a day
     if prefs.max_hours_per_day > 0:
         max_slots_per_day = prefs.max_hours_per_day * (60 // slot_minutes)
-        slot_dates = slots["ds"].dt.date.values
-        for d in np.unique(slot_dates):
-            starts_touching_day = []
-            for t_idx, _ in tasks_df.iterrows():
-                dur = dur_slots_list[t_idx]
-                for i in feasible_by_task[t_idx]:
-                    if any(slots.iloc[i + k]["ds"].date() == d for k in range(dur)):
-                        starts_touching_day.append(x[(t_idx, i)])
-            if starts_touching_day:
-                model.Add(sum(starts_touching_day) <= max_slots_per_day)
-
-    # Objective: maximize total (utility × priority)
-    objective_terms = []
-    for t_idx, task_row in tasks_df.iterrows():
-        dur = dur_slots_list[t_idx]
-        for i in feasible_by_task[t_idx]:
-            u_block = 0.0
-            for k in range(dur):
-                u_block += task_slot_utility(task_row, slots.iloc[i + k])
-            objective_terms.append(u_block * float(task_row.priority) * x[(t_idx, i)])
+        # days are contiguous, so window [i, i + dur) touches day_id[i]..day_id[i + dur - 1]
+        day_id = slots["day"].to_numpy()
+        starts_touching_day: Dict[int, List[cp_model.IntVar]] = {}
+        for t_idx in range(len(tasks_df)):
+            dur = dur_slots_list[t_idx]
+            for i in feasible_by_task[t_idx]:
+                for d in range(day_id[i], day_id[i + dur - 1] + 1):
+                    starts_touching_day.setdefault(d, []).append(x[(t_idx, i)])
+        for day_starts in starts_touching_day.values():
+            model.AddLinearConstraint(
+                cp_model.LinearExpr.Sum(day_starts), 0, max_slots_per_day
+            )
 
-    if objective_terms:
-        model.Maximize(sum(objective_terms))
+    # Objective: maximize total (utility × priority), with integer coefficients
+    obj_vars: List[cp_model.IntVar] = []
+    obj_coeffs: List[int] = []
+    for t_idx, task_row in enumerate(tasks_df.itertuples(index=False)):
+        u_int = np.round(utility_by_task[t_idx] * UTILITY_SCALE).astype(np.int64)
+        obj_vars.extend(x[(t_idx, i)] for i in feasible_by_task[t_idx])
+        obj_coeffs.extend((u_int * int(task_row.priority)).tolist())
 
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = 10
-    _ = solver.Solve(model)
+    if obj_vars:
+        model.Maximize(cp_model.LinearExpr.WeightedSum(obj_vars, obj_coeffs))
+
+    solver = _new_solver()
+    status = solver.Solve(model)
+    chosen = {}
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        chosen = {t_idx: solver.Value(v) for t_idx, v in start_vars.items()}
 
     # Extract schedule
     scheduled = []
-    for t_idx, task_row in tasks_df.iterrows():
+    for t_idx, task_row in enumerate(tasks_df.itertuples(index=False)):
+        if t_idx not in chosen:
+            continue
+        i = chosen[t_idx]
         dur = dur_slots_list[t_idx]
-        for i in feasible_by_task[t_idx]:
-            if (t_idx, i) in x and solver.Value(x[(t_idx, i)]) == 1:
-                start = slots.loc[i, "ds"]
-                end = (
-                    slots.loc[i + dur - 1, "ds"]
-                    + pd.Timedelta(minutes=slot_minutes)
-                )
-                scheduled.append((
-                    task_row.id,
-                    task_row.label,
-                    start,
-                    end,
-                    task_row.priority,
-                ))
-                break
+        start = slots.loc[i, "ds"]
+        end = slots.loc[i + dur - 1, "ds"] + slot_td
+        scheduled.append((
+            task_row.id,
+            task_row.label,
+            start,
+            end,
+            task_row.priority,
+        ))
 
     scheduled_df = pd.DataFrame(
         scheduled, columns=["id", "label", "start", "end", "priority"]
@@ -1,13 +1,24 @@
 # scheduler/prophet_model.py
 from datetime import datetime, timedelta
-from typing import List, Tuple
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Tuple
 
 import numpy as np
 import pandas as pd
-from prophet import Prophet
 
 from .models import UserPrefs, FixedEvent, Task
 
+if TYPE_CHECKING:
+    from prophet import Prophet
+
+_HOUR_NS = 3_600_000_000_000
+_DAY_NS = 24 * _HOUR_NS
+
+
+def to_ns(values) -> np.ndarray:
+    """Convert datetimes (tz-aware or naive) to int64 nanoseconds since epoch."""
+    return pd.DatetimeIndex(values).as_unit("ns").asi8
+
 
 def _compute_meeting_density(slots_df: pd.DataFrame,
                              fixed_df: pd.DataFrame,
@@ -16,75 +27,84 @@ def _compute_meeting_density(slots_df: pd.DataFrame,
     if fixed_df.empty:
         return np.zeros(len(slots_df))
 
-    half = pd.Timedelta(minutes=window_min)
-    vals = []
-    for t in slots_df["ds"]:
-        s, e = t - half, t + half
-        overlap_min = 0.0
-        for _, r in fixed_df.iterrows():
-            st, en = r["start"], r["end"]
-            if en <= s or st >= e:
-                continue
-            overlap_min += (min(en, e) - max(st, s)).total_seconds() / 60.0
-        vals.append(overlap_min / (2 * window_min))
-    return np.array(vals)
+    # (events x slots) overlap of each event with each slot's window, in ns
+    half = window_min * 60_000_000_000
+    t = to_ns(slots_df["ds"])
+    ev_start = to_ns(fixed_df["start"])
+    ev_end = to_ns(fixed_df["end"])
+    overlap = (
+        np.minimum(ev_end[:, None], t[None, :] + half)
+        - np.maximum(ev_start[:, None], t[None, :] - half)
+    )
+    overlap_min = np.clip(overlap, 0, None).sum(axis=0) / 60e9
+    return overlap_min / (2 * window_min)
 
 
 def _add_deadline_pressure(df: pd.DataFrame,
                            tasks_df: pd.DataFrame,
                            window_days: int = 3) -> pd.DataFrame:
-    """Max ramp (0..1) across tasks as deadlines approach within window_days."""
-    out = df.copy()
-    out["deadline_pressure"] = 0.0
-    if len(tasks_df):
-        for _, t in tasks_df.iterrows():
-            ddl = t.get("latest")
-            if pd.notnull(ddl):
-                ddl = pd.to_datetime(ddl)
-                days_left = (ddl - out["ds"]).dt.total_seconds() / 86400
-                out["deadline_pressure"] = np.maximum(
-                    out["deadline_pressure"],
-                    np.clip((window_days - days_left) / window_days, 0, 1),
-                )
-    return out
+    """Max ramp (0..1) across tasks as deadlines approach within window_days (in place)."""
+    ddl_ns = to_ns(pd.to_datetime(tasks_df["latest"]).dropna())
+    if not len(ddl_ns):
+        df["deadline_pressure"] = 0.0
+        return df
+
+    # (tasks x slots) days left until each deadline, max ramp over tasks
+    ds_ns = to_ns(df["ds"])
+    days_left = (ddl_ns[:, None] - ds_ns[None, :]) / _DAY_NS
+    df["deadline_pressure"] = np.clip((window_days - days_left) / window_days, 0, 1).max(axis=0)
+    return df
 
 
 def add_regressors(df: pd.DataFrame,
                    prefs: UserPrefs,
                    fixed_df: pd.DataFrame,
-                   tasks_df: pd.DataFrame) -> pd.DataFrame:
+                   tasks_df: pd.DataFrame,
+                   inplace: bool = True) -> pd.DataFrame:
     """Add preference and context features as Prophet regressors."""
-    out = df.copy()
-    ds = out["ds"]
+    out = df if inplace else df.copy()
+    hour = out["ds"].dt.hour.to_numpy()
 
     out["prefer_morning"] = (
-        (ds.dt.hour >= prefs.prefer_morning_start)
-        & (ds.dt.hour <= prefs.prefer_morning_end)
-    ).astype(int)
+        (hour >= prefs.prefer_morning_start)
+        & (hour <= prefs.prefer_morning_end)
+    ).astype(np.int8)
 
-    out["avoid_late"] = (ds.dt.hour >= prefs.avoid_evenings_after).astype(int)
-    out["is_weekend"] = (ds.dt.weekday >= 5).astype(int)
+    out["avoid_late"] = (hour >= prefs.avoid_evenings_after).astype(np.int8)
+    out["is_weekend"] = (out["ds"].dt.weekday.to_numpy() >= 5).astype(np.int8)
     out["meeting_density"] = _compute_meeting_density(out, fixed_df, window_min=90)
-    out = _add_deadline_pressure(out, tasks_df, window_days=3)
+    _add_deadline_pressure(out, tasks_df, window_days=3)
     return out
 
 
+def _slot_grid(start: datetime,
+               end: datetime,
+               slot_minutes: int) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """Slot starts on [start, end) plus their local wall-clock time as int64 ns."""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    ds_ns = np.arange(start.value, end.value, slot_minutes * 60_000_000_000, dtype=np.int64)
+    ds = pd.DatetimeIndex(ds_ns.view("datetime64[ns]"))
+    if start.tz is None:
+        return ds, ds_ns
+    ds = ds.tz_localize("UTC").tz_convert(start.tz)
+    return ds, ds.tz_localize(None).asi8
+
+
 def build_slots(week_start: datetime,
                 prefs: UserPrefs,
                 days: int = 7) -> pd.DataFrame:
     """Create the grid of candidate time slots for the week."""
     week_end = week_start + timedelta(days=days)
-    slots = pd.DataFrame({
-        "ds": pd.date_range(
-            week_start, week_end,
-            freq=f"{prefs.slot_minutes}min",
-            inclusive="left"
-        )
+    ds, wall = _slot_grid(week_start, week_end, prefs.slot_minutes)
+    weekday = ((wall // _DAY_NS + 3) % 7).astype(np.int8)  # 1970-01-01 was a Thursday
+    return pd.DataFrame({
+        "ds": ds,
+        "hour": ((wall // _HOUR_NS) % 24).astype(np.int8),
+        "weekday": weekday,
+        "is_weekend": (weekday >= 5).astype(np.int8),
+        # local calendar day (days since epoch), used for per-day caps
+        "day": wall // _DAY_NS,
     })
-    slots["hour"] = slots["ds"].dt.hour
-    slots["weekday"] = slots["ds"].dt.weekday
-    slots["is_weekend"] = (slots["weekday"] >= 5).astype(int)
-    return slots
 
 
 def build_history(week_start: datetime,
@@ -92,37 +112,50 @@ def build_history(week_start: datetime,
     """Build a simple 4-week pseudo-history with priors for Prophet cold-start."""
     hist_start = week_start - timedelta(days=28)
     hist_end = week_start
-    hist = pd.DataFrame({
-        "ds": pd.date_range(
-            hist_start, hist_end,
-            freq=f"{prefs.slot_minutes}min",
-            inclusive="left"
-        )
-    })
-    hist["hour"] = hist["ds"].dt.hour
-    hist["weekday"] = hist["ds"].dt.weekday
+    ds, wall = _slot_grid(hist_start, hist_end, prefs.slot_minutes)
+    hour = ((wall // _HOUR_NS) % 24).astype(np.int8)
+    weekday = ((wall // _DAY_NS + 3) % 7).astype(np.int8)
+    hist = pd.DataFrame({"ds": ds, "hour": hour, "weekday": weekday})
     hist["prefer_morning"] = (
-        (hist["hour"] >= prefs.prefer_morning_start)
-        & (hist["hour"] <= prefs.prefer_morning_end)
-    ).astype(int)
-    hist["avoid_late"] = (hist["hour"] >= prefs.avoid_evenings_after).astype(int)
-    hist["is_weekend"] = (hist["weekday"] >= 5).astype(int)
-
-    # Prior utility ~ 0.65 for morning, 0.45 otherwise, minus penalties
-    base = (
+        (hour >= prefs.prefer_morning_start)
+        & (hour <= prefs.prefer_morning_end)
+    ).astype(np.int8)
+    hist["avoid_late"] = (hour >= prefs.avoid_evenings_after).astype(np.int8)
+    hist["is_weekend"] = (weekday >= 5).astype(np.int8)
+
+    hist["y"] = np.clip(_prior_utility(hist), 0.05, 0.95)
+    return hist
+
+
+def _prior_utility(df: pd.DataFrame) -> pd.Series:
+    """Prior utility ~ 0.65 for morning, 0.45 otherwise, minus penalties."""
+    return (
         0.45
-        + 0.20 * hist["prefer_morning"]
-        - 0.15 * hist["avoid_late"]
-        - 0.15 * hist["is_weekend"]
+        + 0.20 * df["prefer_morning"]
+        - 0.15 * df["avoid_late"]
+        - 0.15 * df["is_weekend"]
     )
-    hist["y"] = np.clip(base, 0.05, 0.95)
-    return hist
 
 
-def fit_prophet(hist_reg: pd.DataFrame) -> Prophet:
+def analytic_utility(future_reg: pd.DataFrame) -> pd.Series:
+    """
+    Closed-form stand-in for the Prophet fit: the cold-start prior evaluated
+    directly on the slots, adjusted for nearby meetings and deadlines.
+    """
+    return (
+        np.clip(_prior_utility(future_reg), 0.05, 0.95)
+        - 0.30 * future_reg["meeting_density"]
+        + 0.20 * future_reg["deadline_pressure"]
+    )
+
+
+def fit_prophet(hist_reg: pd.DataFrame) -> "Prophet":
     """Fit Prophet model on prepared history with regressors."""
-    df = hist_reg.copy()
-    df["ds"] = pd.to_datetime(df["ds"]).dt.tz_localize(None)
+    # imported here: Prophet is slow to import and off by default
+    from prophet import Prophet
+
+    # Prophet needs naive wall-clock times; ds is already datetime64[ns, tz]
+    df = hist_reg.assign(ds=hist_reg["ds"].dt.tz_localize(None))
 
     m = Prophet(
         daily_seasonality=True,
@@ -135,7 +168,7 @@ def fit_prophet(hist_reg: pd.DataFrame) -> Prophet:
                 "meeting_density", "deadline_pressure"]:
         m.add_regressor(reg)
 
-    m.fit(df.rename(columns={"y": "y"}))
+    m.fit(df)
     return m
 
 
@@ -146,12 +179,33 @@ def score_slots_with_prophet(
     tasks: List[Task],
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Build history, fit Prophet, and score slots for the target week.
+    Score slots for the target week, either by building history and
+    fitting Prophet (prefs.use_prophet) or with the analytic prior.
+    Repeated calls with the same inputs reuse a cached result.
 
     Returns:
-        slots: dataframe with 'ds', 'hour', 'weekday', 'is_weekend', 'utility_base'
+        slots: dataframe with 'ds', 'hour', 'weekday', 'is_weekend', 'day', 'utility_base'
         fixed_df: fixed events dataframe aligned to slots
     """
+    slots, fixed_df = _score_slots_cached(
+        pd.Timestamp(week_start), prefs, tuple(fixed_events), tuple(tasks)
+    )
+    # callers get their own frames so the cached ones stay untouched
+    return slots.copy(), fixed_df.copy()
+
+
+@lru_cache(maxsize=8)
+def _score_slots_cached(week_start: pd.Timestamp,
+                        prefs: UserPrefs,
+                        fixed_events: Tuple[FixedEvent, ...],
+                        tasks: Tuple[Task, ...]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return _score_slots(week_start, prefs, list(fixed_events), list(tasks))
+
+
+def _score_slots(week_start: datetime,
+                 prefs: UserPrefs,
+                 fixed_events: List[FixedEvent],
+                 tasks: List[Task]) -> Tuple[pd.DataFrame, pd.DataFrame]:
     # Convert input lists to dataframes for easier handling
     if fixed_events:
         fixed_df = pd.DataFrame([{
@@ -176,18 +230,20 @@ def score_slots_with_prophet(
             "id", "label", "dur_h", "priority", "latest"
         ])
 
-    # Build grids
+    # Build grid & add regressors
     slots = build_slots(week_start, prefs)
-    hist = build_history(week_start, prefs)
+    future_reg = add_regressors(slots[["ds"]].copy(), prefs, fixed_df, tasks_df)
 
-    # Add regressors
+    if not prefs.use_prophet:
+        slots["utility_base"] = analytic_utility(future_reg).clip(0, 1).values
+        return slots, fixed_df
+
+    hist = build_history(week_start, prefs)
     hist_reg = add_regressors(hist[["ds", "y"]].copy(), prefs, fixed_df, tasks_df)
-    future_reg = add_regressors(slots[["ds"]].copy(), prefs, fixed_df, tasks_df)
 
     # Fit & predict
     m = fit_prophet(hist_reg)
-    fut = future_reg.copy()
-    fut["ds"] = pd.to_datetime(fut["ds"]).dt.tz_localize(None)
+    fut = future_reg.assign(ds=future_reg["ds"].dt.tz_localize(None))
     forecast = m.predict(fut)
 
     slots["utility_base"] = forecast["yhat"].clip(0, 1).values